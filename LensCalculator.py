@@ -1,7 +1,17 @@
 import numpy as np
 import matplotlib.pyplot as plt
-from typing import List, Tuple, Dict
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba_array
+from typing import List, Tuple
+from collections import namedtuple
 from enum import Enum
+import argparse
+import os
+import sys
+from functools import lru_cache
+from numba import njit
+from LensInput import load_lens_table
+from LensPlotting import shared_figure, save_figure
 
 class LensType(Enum):
     CONVERGING = "converging"
@@ -15,6 +25,28 @@ class AberrationType(Enum):
     COMA = "coma"
     ASTIGMATISM = "astigmatism"
 
+# Aberration coefficients, one field per AberrationType (in declaration order)
+Aberrations = namedtuple("Aberrations", [a.value for a in AberrationType])
+
+def _aberration_terms(D, f, dispersion):
+    """Spherical, chromatic, coma and astigmatism coefficients.
+
+    Works on floats and on NumPy arrays of lens parameters alike.
+    """
+    D2 = D * D
+    D3 = D2 * D
+    D4 = D2 * D2
+    f2 = f * f
+    f3 = f2 * f
+    return 0.125 * D4 / f3, f * dispersion, 0.25 * D3 / f2, 0.5 * D2 / f
+
+# Scalar path, compiled from the same formulas
+_aberr = njit("UniTuple(float64, 4)(float64, float64, float64)", cache=True)(_aberration_terms)
+
+@lru_cache(maxsize=1024)
+def _cached_aberrations(D: float, f: float, dispersion: float) -> Aberrations:
+    return Aberrations(*_aberr(D, f, dispersion))
+
 class Lens:
     def __init__(self, focal_length: float, lens_type: LensType, diameter: float = 5.0):
         self.focal_length = focal_length
@@ -23,158 +55,198 @@ class Lens:
         self.refractive_index = 1.5  # Default glass
         self.dispersion = 0.02  # Abbe number related
 
-    def calculate_aberrations(self) -> Dict[str, float]:
+    def calculate_aberrations(self) -> Aberrations:
         """Calculate various aberration coefficients."""
-        aberrations = {}
-        
-        # Spherical aberration
-        aberrations[AberrationType.SPHERICAL.value] = (
-            0.125 * (self.diameter**4) / (self.focal_length**3)
-        )
-        
-        # Chromatic aberration
-        aberrations[AberrationType.CHROMATIC.value] = (
-            self.focal_length * self.dispersion
-        )
-        
-        # Coma
-        aberrations[AberrationType.COMA.value] = (
-            0.25 * (self.diameter**3) / (self.focal_length**2)
-        )
-        
-        # Astigmatism
-        aberrations[AberrationType.ASTIGMATISM.value] = (
-            0.5 * (self.diameter**2) / self.focal_length
-        )
-        
-        return aberrations
+        return _cached_aberrations(float(self.diameter), float(self.focal_length),
+                                   float(self.dispersion))
+
+    @staticmethod
+    def calculate_aberrations_batch(lenses: List["Lens"]) -> np.ndarray:
+        """Aberration coefficients for many lenses as an (n, 4) array."""
+        params = np.asarray([(l.diameter, l.focal_length, l.dispersion) for l in lenses],
+                            dtype=np.float64).reshape(-1, 3)
+        return np.column_stack(_aberration_terms(*params.T))
 
 class LensCalculator:
     def __init__(self):
         self.focal_units = "cm"
         
+    @staticmethod
+    def _as_fs(lenses: List[Lens]) -> np.ndarray:
+        """Focal lengths of lenses as an ndarray."""
+        return np.fromiter((l.focal_length for l in lenses), dtype=np.float64, count=len(lenses))
+        
     def series_focal_length(self, lenses: List[Lens]) -> float:
         """Calculate focal length for lenses in series."""
         if not lenses:
             return 0
-        total_power = sum(1/lens.focal_length for lens in lenses)
-        return 1/total_power if total_power != 0 else float('inf')
+        fs = self._as_fs(lenses)
+        if not fs.all():
+            raise ZeroDivisionError("lens with focal length 0 in series combination")
+        total_power = np.reciprocal(fs).sum()
+        return float(1.0/total_power) if total_power != 0 else float('inf')
     
     def parallel_focal_length(self, lenses: List[Lens]) -> float:
         """Calculate focal length for lenses in parallel."""
-        return sum(lens.focal_length for lens in lenses)
+        return float(self._as_fs(lenses).sum())
     
-    def draw_ray_diagram(self, lens: Lens, object_distance: float, height: float = 2.0):
+    def draw_ray_diagram(self, lens: Lens, object_distance: float, height: float = 2.0, fig=None):
         """Draw ray diagram for a single lens."""
-        plt.figure(figsize=(12, 6))
+        if fig is None:
+            fig, ax = shared_figure((12, 6))
+        else:
+            ax = fig.axes[0] if fig.axes else fig.add_subplot()
+        ax.clear()
         
         # Setup the plot
-        ax = plt.gca()
         ax.spines['left'].set_position('center')
         ax.spines['right'].set_visible(False)
         ax.spines['top'].set_visible(False)
         
         # Draw optical axis
-        plt.axhline(y=0, color='k', linestyle='-', alpha=0.3)
-        
-        # Draw lens
-        lens_x = 0
-        lens_height = 3
-        if lens.lens_type == LensType.CONVERGING:
-            plt.plot([lens_x, lens_x], [-lens_height, lens_height], 'b-', linewidth=2)
-            # Add lens curvature
-            plt.plot([-0.5 + lens_x, 0.5 + lens_x], [-lens_height, -lens_height], 'b-')
-            plt.plot([-0.5 + lens_x, 0.5 + lens_x], [lens_height, lens_height], 'b-')
-        else:  # Diverging lens
-            plt.plot([lens_x, lens_x], [-lens_height, lens_height], 'r-', linewidth=2)
-            # Add lens curvature (opposite direction)
-            plt.plot([0.5 + lens_x, -0.5 + lens_x], [-lens_height, -lens_height], 'r-')
-            plt.plot([0.5 + lens_x, -0.5 + lens_x], [lens_height, lens_height], 'r-')
+        ax.axhline(y=0, color='k', linestyle='-', alpha=0.3)
         
         # Calculate image distance
         image_distance = (object_distance * lens.focal_length) / (object_distance - lens.focal_length)
         magnification = -image_distance / object_distance
+        image_height = -height * magnification
+        converging = lens.lens_type == LensType.CONVERGING
         
-        # Draw focal points
-        plt.plot([lens.focal_length, lens.focal_length], [-0.2, 0.2], 'k-')
-        plt.plot([-lens.focal_length, -lens.focal_length], [-0.2, 0.2], 'k-')
-        plt.text(lens.focal_length, -0.5, 'F', fontsize=12)
-        plt.text(-lens.focal_length, -0.5, 'F', fontsize=12)
+        # Every straight segment goes into a single LineCollection:
+        # lens stem, 2 curvature ticks, 2 focal marks and, for a
+        # converging lens, the 5 principal ray segments.
+        lens_x = 0
+        lens_height = 3
+        lens_color = 'b' if converging else 'r'
+        f = lens.focal_length
         
-        # Draw object
-        plt.arrow(-object_distance, 0, 0, height, head_width=0.2, head_length=0.2, fc='k', ec='k')
+        segs = np.empty((10 if converging else 5, 2, 2))
+        segs[0] = [[lens_x, -lens_height], [lens_x, lens_height]]
+        segs[1] = [[lens_x - 0.5, -lens_height], [lens_x + 0.5, -lens_height]]
+        segs[2] = [[lens_x - 0.5, lens_height], [lens_x + 0.5, lens_height]]
+        segs[3] = [[f, -0.2], [f, 0.2]]
+        segs[4] = [[-f, -0.2], [-f, 0.2]]
+        colors = [lens_color] * 3 + ['k'] * 2
+        styles = ['-'] * 5
+        line_width = plt.rcParams['lines.linewidth']  # Default width of plot()
+        widths = [2] + [line_width] * 4
+        alphas = [1.0] * 5
         
-        # Draw principal rays
-        if lens.lens_type == LensType.CONVERGING:
+        if converging:
             # Ray parallel to optical axis
-            plt.plot([-object_distance, 0], [height, height], 'g--', alpha=0.5)
-            plt.plot([0, lens.focal_length], [height, 0], 'g--', alpha=0.5)
-            
+            segs[5] = [[-object_distance, height], [0, height]]
+            segs[6] = [[0, height], [f, 0]]
             # Ray through center
-            plt.plot([-object_distance, image_distance], [height, -height * magnification], 'r--', alpha=0.5)
-            
+            segs[7] = [[-object_distance, height], [image_distance, image_height]]
             # Ray through focal point
-            plt.plot([-object_distance, 0], [height, lens.focal_length], 'b--', alpha=0.5)
-            plt.plot([0, image_distance], [lens.focal_length, -height * magnification], 'b--', alpha=0.5)
-            
-            # Draw image
+            segs[8] = [[-object_distance, height], [0, f]]
+            segs[9] = [[0, f], [image_distance, image_height]]
+            colors += ['g', 'g', 'r', 'b', 'b']
+            styles += ['--'] * 5
+            widths += [line_width] * 5
+            alphas += [0.5] * 5
+        
+        ax.add_collection(LineCollection(segs, colors=to_rgba_array(colors, alpha=alphas),
+                                         linestyles=styles, linewidths=widths))
+        
+        ax.text(f, -0.5, 'F', fontsize=12)
+        ax.text(-f, -0.5, 'F', fontsize=12)
+        
+        # Draw object
+        ax.arrow(-object_distance, 0, 0, height, head_width=0.2, head_length=0.2, fc='k', ec='k')
+        
+        # Draw image
+        if converging:
             if image_distance > 0:  # Real image
-                plt.arrow(image_distance, 0, 0, -height * magnification, 
+                ax.arrow(image_distance, 0, 0, image_height,
                          head_width=0.2, head_length=0.2, fc='k', ec='k', linestyle='--')
             else:  # Virtual image
-                plt.arrow(image_distance, 0, 0, -height * magnification, 
+                ax.arrow(image_distance, 0, 0, image_height,
                          head_width=0.2, head_length=0.2, fc='k', ec='k', linestyle=':', alpha=0.5)
         
-        plt.grid(True, alpha=0.3)
-        plt.xlabel('Distance (cm)')
-        plt.ylabel('Height (cm)')
+        ax.grid(True, alpha=0.3)
+        ax.set_xlabel('Distance (cm)')
+        ax.set_ylabel('Height (cm)')
         title = f"{lens.lens_type.value.capitalize()} Lens Ray Diagram\n"
         title += f"f = {lens.focal_length:.1f} cm, do = {object_distance:.1f} cm"
-        plt.title(title)
+        ax.set_title(title)
         
         # Set reasonable plot limits
         max_dist = max(abs(object_distance), abs(image_distance), abs(lens.focal_length)) * 1.2
-        plt.xlim(-max_dist, max_dist)
-        plt.ylim(-max_dist/2, max_dist/2)
+        ax.set_xlim(-max_dist, max_dist)
+        ax.set_ylim(-max_dist/2, max_dist/2)
         
-        plt.savefig('ray_diagram.png')
-        plt.close()
+        save_figure(fig, 'ray_diagram.png')
 
-def main():
-    calculator = LensCalculator()
-    
-    # Get lens information
-    print("Available lens types:")
-    for lens_type in LensType:
-        print(f"- {lens_type.value}")
+def _warmup():
+    """Run each kernel once so first use does not pay dispatch setup."""
+    _aberr(1.0, 1.0, 1.0)
+
+if os.environ.get("LENS_WARMUP", "1") == "1":
+    _warmup()
+
+def _print_aberrations(lens: Lens):
+    print("\nAberration Analysis:")
+    aberrations = lens.calculate_aberrations()
+    for aberration_type, value in aberrations._asdict().items():
+        print(f"{aberration_type.capitalize()} aberration: {value:.2e}")
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Lens combination and ray diagram calculator")
+    parser.add_argument("--config", help="CSV file with one 'focal_length,diameter' row per lens (cm); "
+                                         "without it, piped stdin is read in the same format")
+    parser.add_argument("--object-distance", type=float, help="Object distance (cm) for the ray diagram")
+    parser.add_argument("--interactive", action="store_true", help="Prompt for each lens")
+    args = parser.parse_args(argv)
+    interactive = args.interactive or (args.config is None and sys.stdin.isatty())
     
+    calculator = LensCalculator()
     lenses = []
-    while True:
+    
+    if not interactive:
         try:
-            f = float(input(f"\nEnter focal length #{len(lenses) + 1} (cm, or 0 to finish): "))
-            if f == 0:
-                break
-                
-            lens_type_str = input("Enter lens type: ").lower()
-            try:
-                lens_type = LensType(lens_type_str)
-            except ValueError:
-                print("Invalid lens type. Using converging lens.")
-                lens_type = LensType.CONVERGING
-                
-            diameter = float(input("Enter lens diameter (cm, default 5.0): ") or 5.0)
-            
+            data = load_lens_table(args.config)
+        except (OSError, ValueError) as e:
+            sys.exit(f"Could not read lens data: {e}")
+        if data.size == 0:
+            print("No lenses entered. Exiting.")
+            return
+        if data.shape[1] < 2:
+            data = np.column_stack((data[:, 0], np.full(len(data), 5.0)))
+        for f, diameter in data[:, :2]:
+            lens_type = LensType.CONVERGING if f > 0 else LensType.DIVERGING
             lens = Lens(f, lens_type, diameter)
             lenses.append(lens)
-            
-            # Calculate and display aberrations
-            print("\nAberration Analysis:")
-            aberrations = lens.calculate_aberrations()
-            for aberration_type, value in aberrations.items():
-                print(f"{aberration_type.capitalize()} aberration: {value:.2e}")
+            _print_aberrations(lens)
+    else:
+        # Get lens information
+        print("Available lens types:")
+        for lens_type in LensType:
+            print(f"- {lens_type.value}")
+        
+        while True:
+            try:
+                f = float(input(f"\nEnter focal length #{len(lenses) + 1} (cm, or 0 to finish): "))
+                if f == 0:
+                    break
+                    
+                lens_type_str = input("Enter lens type: ").lower()
+                try:
+                    lens_type = LensType(lens_type_str)
+                except ValueError:
+                    print("Invalid lens type. Using converging lens.")
+                    lens_type = LensType.CONVERGING
+                    
+                diameter = float(input("Enter lens diameter (cm, default 5.0): ") or 5.0)
                 
-        except ValueError:
-            print("Please enter valid numbers.")
+                lens = Lens(f, lens_type, diameter)
+                lenses.append(lens)
+                
+                # Calculate and display aberrations
+                _print_aberrations(lens)
+                    
+            except ValueError:
+                print("Please enter valid numbers.")
     
     if not lenses:
         print("No lenses entered. Exiting.")
@@ -189,7 +261,12 @@ def main():
     print(f"Parallel combination focal length: {parallel_f:.2f} cm")
     
     # Draw ray diagram for first lens
-    object_distance = float(input("\nEnter object distance (cm) for ray diagram: "))
+    object_distance = args.object_distance
+    if object_distance is None:
+        if not interactive:
+            print("\nNo --object-distance given; skipping ray diagram.")
+            return
+        object_distance = float(input("\nEnter object distance (cm) for ray diagram: "))
     calculator.draw_ray_diagram(lenses[0], object_distance)
     print("Ray diagram saved as 'ray_diagram.png'")
 
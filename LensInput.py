@@ -0,0 +1,26 @@
+import sys
+import numpy as np
+
+def load_lens_table(path: str = None) -> np.ndarray:
+    """Read comma-separated lens rows from path, or all of stdin at once.
+
+    Blank lines and '#' comments are skipped and, as with interactive
+    input, a row whose focal length (first column) is 0 ends the list.
+    Returns an empty array if no lenses were given; raises ValueError on
+    malformed rows.
+    """
+    if path:
+        with open(path) as f:
+            text = f.read()
+    else:
+        text = sys.stdin.read()
+
+    # Drop '#' comments and blank lines so loadtxt never sees an empty table
+    rows = [line.split('#', 1)[0] for line in text.splitlines()]
+    rows = [line for line in rows if line.strip()]
+    if not rows:
+        return np.empty((0, 0))
+
+    data = np.loadtxt(rows, delimiter=',', dtype=float, ndmin=2)
+    stop = np.flatnonzero(data[:, 0] == 0)
+    return data[:stop[0]] if stop.size else data
@@ -0,0 +1,22 @@
+from functools import lru_cache
+from typing import Tuple
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+@lru_cache(maxsize=None)
+def shared_figure(figsize: Tuple[float, float], nrows: int = 1, ncols: int = 1):
+    """Off-screen figure and axes reused by every call with the same layout.
+
+    The figure is built outside pyplot, so plt.close() and plt.show()
+    never see it.
+    """
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig, fig.subplots(nrows, ncols)
+
+def save_figure(fig: Figure, path: str):
+    """Save fig, asking interactive canvases to redraw as well."""
+    fig.savefig(path)
+    # savefig has already rendered a plain Agg canvas; redrawing would do it twice
+    if type(fig.canvas) is not FigureCanvasAgg:
+        fig.canvas.draw_idle()
@@ -1,8 +1,13 @@
 import numpy as np
-import matplotlib.pyplot as plt
 from typing import List, Tuple, Dict
 from enum import Enum
-from scipy.special import j0  # Bessel function for diffraction
+import argparse
+import math
+import os
+import sys
+from numba import njit, prange
+from LensInput import load_lens_table
+from LensPlotting import shared_figure, save_figure
 
 class WaveProperties:
     def __init__(self, wavelength: float = 550e-9):  # Default: green light
@@ -11,15 +16,44 @@ class WaveProperties:
         self.omega = 3e8 * self.k        # Angular frequency
 
 class OpticalMaterial:
+    _generation = 0  # Bumped on every attribute change so LensSystem can refresh its arrays
+    
     def __init__(self, n0: float, dn_dT: float = 1e-6):
         self.n0 = n0                  # Refractive index at reference temperature
         self.dn_dT = dn_dT           # Thermal coefficient of refractive index
         self.reference_temp = 20.0    # Reference temperature in Celsius
+    
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        OpticalMaterial._generation += 1
         
     def get_n(self, T: float) -> float:
         """Get refractive index at temperature T"""
         return self.n0 + self.dn_dT * (T - self.reference_temp)
 
+@njit("UniTuple(float64, 4)(float64[::1], float64[::1], float64[::1])",
+      cache=True, fastmath=True)
+def _transfer_matrix_core(fs, ds, ns):
+    """Multiply out the lens chain as scalars, returning (A, B, C, D)"""
+    # Lens powers 1/(f*n) up front so the chain below is multiply-only
+    inv_fn = np.empty_like(fs)
+    for i in range(fs.size):
+        inv_fn[i] = 1.0 / (fs[i] * ns[i])
+    
+    a, b, c, d = 1.0, 0.0, 0.0, 1.0
+    
+    for i in range(fs.size):
+        # Propagation: M @ [[1, d], [0, 1]]
+        if i < ds.size:
+            b = a * ds[i] + b
+            d = c * ds[i] + d
+        
+        # Thin lens: M @ [[1, 0], [-1/(f*n), 1]]
+        a = a - b * inv_fn[i]
+        c = c - d * inv_fn[i]
+    
+    return a, b, c, d
+
 class LensSystem:
     def __init__(self, focal_lengths: List[float], distances: List[float], 
                  materials: List[OpticalMaterial]):
@@ -27,25 +61,131 @@ class LensSystem:
         self.distances = distances    # Distances between lenses
         self.materials = materials
         self.temperature = 20.0      # Operating temperature
+    
+    # Lens data is flattened into contiguous arrays once, when assigned.
+    # The lists are exposed as tuples so in-place edits fail loudly;
+    # assign a new sequence to change them.
+    @property
+    def focal_lengths(self) -> Tuple[float, ...]:
+        return self._focal_lengths
+    
+    @focal_lengths.setter
+    def focal_lengths(self, focal_lengths: List[float]):
+        self._focal_lengths = tuple(focal_lengths)
+        self._fs = np.array(self._focal_lengths, dtype=np.float64)
+    
+    @property
+    def distances(self) -> Tuple[float, ...]:
+        return self._distances
+    
+    @distances.setter
+    def distances(self, distances: List[float]):
+        self._distances = tuple(distances)
+        self._ds = np.array(self._distances, dtype=np.float64)
+    
+    @property
+    def materials(self) -> Tuple[OpticalMaterial, ...]:
+        return self._materials
+    
+    @materials.setter
+    def materials(self, materials: List[OpticalMaterial]):
+        self._materials = tuple(materials)
+        # Subclasses with their own temperature model go through get_n
+        self._custom_n = any(type(m).get_n is not OpticalMaterial.get_n for m in self._materials)
+        self._flatten_materials()
+    
+    def _flatten_materials(self):
+        count = len(self._materials)
+        self._n0 = np.fromiter((m.n0 for m in self._materials), np.float64, count)
+        self._dnT = np.fromiter((m.dn_dT for m in self._materials), np.float64, count)
+        self._T_ref = np.fromiter((m.reference_temp for m in self._materials), np.float64, count)
+        self._materials_generation = OpticalMaterial._generation
+    
+    def refractive_indices(self, T) -> np.ndarray:
+        """Refractive index of every lens at temperature(s) T, shape (n_lens,) + T.shape"""
+        if self._materials_generation != OpticalMaterial._generation:
+            self._flatten_materials()  # A material was edited since the last call
+        
+        T = np.asarray(T, dtype=np.float64)
+        if self._custom_n:
+            return np.array([np.broadcast_to(m.get_n(T), T.shape) for m in self._materials],
+                            dtype=np.float64).reshape((len(self._materials),) + T.shape)
+        
+        shape = (-1,) + (1,) * T.ndim
+        return self._n0.reshape(shape) + self._dnT.reshape(shape) * (T - self._T_ref.reshape(shape))
+    
+    def _check_materials(self, ns: np.ndarray):
+        if ns.shape[0] < self._fs.size:
+            raise IndexError(f"{self._fs.size} lenses but only {ns.shape[0]} materials")
         
     def transfer_matrix(self) -> np.ndarray:
         """Calculate system transfer matrix"""
-        M = np.eye(2)
-        
-        for i, f in enumerate(self.focal_lengths):
-            # Propagation matrix
-            if i < len(self.distances):
-                P = np.array([[1, self.distances[i]], [0, 1]])
-            else:
-                P = np.eye(2)
-            
-            # Thin lens matrix
-            n = self.materials[i].get_n(self.temperature)
-            L = np.array([[1, 0], [-1/(f*n), 1]])
+        ns = self.refractive_indices(self.temperature)
+        self._check_materials(ns)
+        a, b, c, d = _transfer_matrix_core(self._fs, self._ds, ns)
+        return np.array([[a, b], [c, d]])
+    
+    def focal_length_vs_temperature(self, temps: np.ndarray) -> np.ndarray:
+        """Effective focal length at each temperature, evaluated in one pass"""
+        temps = np.asarray(temps, dtype=np.float64)
+        
+        fs = self._fs
+        ds = self._ds
+        
+        # Lens power 1/(f*n) per lens and temperature, shape (n_lens, N)
+        ns = self.refractive_indices(temps)
+        self._check_materials(ns)
+        inv_fn = np.reciprocal(fs[:, None] * ns[:fs.size])
+        
+        A = np.ones_like(temps)
+        B = np.zeros_like(temps)
+        C = np.zeros_like(temps)
+        D = np.ones_like(temps)
+        
+        for i in range(fs.size):
+            # Propagation
+            if i < ds.size:
+                B = A * ds[i] + B
+                D = C * ds[i] + D
             
-            M = M @ P @ L
+            # Thin lens
+            A = A - B * inv_fn[i]
+            C = C - D * inv_fn[i]
         
-        return M
+        return -1.0 / C
+
+@njit("float64(float64)", cache=True, fastmath=True)
+def _j0(x):
+    """Bessel function J0 (Abramowitz & Stegun 9.4.1 / 9.4.3, |error| < 5e-8)"""
+    ax = abs(x)
+    if ax < 3.0:
+        t = (ax / 3.0)**2
+        return (1.0 + t*(-2.2499997 + t*(1.2656208 + t*(-0.3163866
+                + t*(0.0444479 + t*(-0.0039444 + t*0.0002100))))))
+    
+    t = 3.0 / ax
+    f0 = (0.79788456 + t*(-0.00000077 + t*(-0.00552740 + t*(-0.00009512
+          + t*(0.00137237 + t*(-0.00072805 + t*0.00014476))))))
+    theta0 = (ax - 0.78539816 + t*(-0.04166397 + t*(-0.00003954 + t*(0.00262573
+              + t*(-0.00054125 + t*(-0.00029333 + t*0.00013558))))))
+    return f0 * math.cos(theta0) / math.sqrt(ax)
+
+@njit("float64[::1](float64[::1], float64, float64, float64)",
+      cache=True, fastmath=True, parallel=True)
+def _airy_intensity(r, k, R, z):
+    """Fraunhofer intensity (R * J0(k*R*r/z))**2 at each radius"""
+    I = np.empty_like(r)
+    for i in prange(r.size):
+        I[i] = (R * _j0(k * R * r[i] / z))**2
+    return I
+
+@njit("float64[::1](float64[::1], float64, float64[::1])",
+      cache=True, fastmath=True, parallel=True)
+def _interf(theta, kd_half, out):
+    """Double-slit intensity cos(kd/2 * sin(theta))**2, written into out"""
+    for i in prange(theta.size):
+        out[i] = math.cos(kd_half * math.sin(theta[i]))**2
+    return out
 
 class WaveOpticsCalculator:
     def __init__(self, wave: WaveProperties):
@@ -55,12 +195,25 @@ class WaveOpticsCalculator:
                             points: int = 1000) -> Tuple[np.ndarray, np.ndarray]:
         """Calculate Fraunhofer diffraction pattern"""
         r = np.linspace(0, aperture_radius * 10, points)
-        I = (aperture_radius * j0(self.wave.k * aperture_radius * r / distance))**2
+        I = _airy_intensity(r, float(self.wave.k), float(aperture_radius), float(distance))
         return r, I
     
-    def calculate_interference(self, d: float, theta: np.ndarray) -> np.ndarray:
-        """Calculate double-slit interference pattern"""
-        return np.cos(self.wave.k * d * np.sin(theta) / 2)**2
+    def calculate_interference(self, d: float, theta: np.ndarray,
+                               out: np.ndarray = None) -> np.ndarray:
+        """Calculate double-slit interference pattern (reusing out if given)"""
+        theta = np.asarray(theta, dtype=np.float64)
+        if out is None:
+            out = np.empty(theta.shape)
+        elif (out.shape != theta.shape or out.dtype != np.float64
+              or not out.flags.c_contiguous):
+            raise ValueError("out must be a C-contiguous float64 array shaped like theta")
+        
+        # The kernel takes writable flat arrays; out.ravel() is a view since out is contiguous
+        theta = np.ascontiguousarray(theta).ravel()
+        if not theta.flags.writeable:
+            theta = theta.copy()  # e.g. read-only memmaps or np.frombuffer
+        _interf(theta, float(self.wave.k * d / 2), out.ravel())
+        return out if out.ndim else out[()]
 
 class RayTracer:
     def __init__(self, lens_system: LensSystem):
@@ -68,52 +221,79 @@ class RayTracer:
         
     def trace_ray(self, y0: float, theta0: float) -> List[Tuple[float, float]]:
         """Trace a ray through the system"""
-        ray = np.array([y0, theta0])
-        positions = [(0, y0)]
-        z = 0
-        
-        M = self.lens_system.transfer_matrix()
-        ray = M @ ray
+        z, ys = self.trace_rays(np.array([y0]), np.array([theta0]))
+        return list(zip(z, ys[0]))
+    
+    def trace_rays(self, y0: np.ndarray, theta0: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Trace a batch of rays, returning z (n_stages,) and y (n_rays, n_stages)"""
+        y0, theta0 = np.broadcast_arrays(np.atleast_1d(np.asarray(y0, dtype=np.float64)),
+                                         np.atleast_1d(np.asarray(theta0, dtype=np.float64)))
+        system = self.lens_system
+        fs, ds = system._fs, system._ds
+        ns = system.refractive_indices(system.temperature)
+        system._check_materials(ns)
+        inv_fn = 1.0 / (fs * ns[:fs.size])
         
-        for d in self.lens_system.distances:
-            z += d
-            positions.append((z, ray[0]))
-            
-        return positions
+        # transfer_matrix() is P_0 L_0 P_1 L_1 ... L_{n-1}, so a ray meets the
+        # rightmost factor first. Walk the factors right to left, keeping the
+        # running product S as scalars, and record y after each propagation.
+        n_prop = min(ds.size, fs.size)
+        z = np.zeros(n_prop + 1)
+        ys = np.empty((y0.size, n_prop + 1))
+        ys[:, 0] = y0
+        a, b, c, d = 1.0, 0.0, 0.0, 1.0
+        stage = 0
+        for i in range(fs.size - 1, -1, -1):
+            # Thin lens: S = L_i @ S
+            c, d = c - inv_fn[i] * a, d - inv_fn[i] * b
+            if i < ds.size:
+                # Propagation: S = P_i @ S
+                a, b = a + ds[i] * c, b + ds[i] * d
+                stage += 1
+                z[stage] = z[stage - 1] + ds[i]
+                ys[:, stage] = a * y0 + b * theta0
+        return z, ys
 
 class OpticalSystemOptimizer:
     def __init__(self, lens_system: LensSystem):
         self.lens_system = lens_system
         
-    def optimize_focal_length(self, target_f: float) -> List[float]:
+    def optimize_focal_length(self, target_f: float) -> np.ndarray:
         """Optimize lens positions for desired focal length"""
-        # Simple optimization: adjust last lens position
+        return self.optimize_focal_length_inplace(target_f, np.empty_like(self.lens_system._ds))
+    
+    def optimize_focal_length_inplace(self, target_f: float, out: np.ndarray) -> np.ndarray:
+        """Write the optimized lens positions into a preallocated buffer"""
+        # Simple optimization: scale all separations by target_f / current_f,
+        # where current_f = -1/M[1,0]
         M = self.lens_system.transfer_matrix()
-        current_f = -1/M[1,0]
-        scale = target_f/current_f
-        
-        new_distances = [d * scale for d in self.lens_system.distances]
-        return new_distances
+        return np.multiply(self.lens_system._ds, -target_f * M[1, 0], out=out)
 
-def plot_system_analysis(lens_system: LensSystem, wave: WaveProperties):
+def plot_system_analysis(lens_system: LensSystem, wave: WaveProperties, fig=None):
     """Create comprehensive system analysis plots"""
-    fig = plt.figure(figsize=(15, 10))
+    if fig is None:
+        fig, axes = shared_figure((15, 10), 2, 2)
+        axes = tuple(axes.flat)
+    else:
+        axes = fig.axes
+        if len(axes) != 4:
+            fig.clear()
+            axes = tuple(fig.subplots(2, 2).flat)
+    ax1, ax2, ax3, ax4 = axes
+    for ax in axes:
+        ax.clear()
     
     # Ray tracing
-    ax1 = fig.add_subplot(221)
     tracer = RayTracer(lens_system)
-    rays = [tracer.trace_ray(y, 0) for y in np.linspace(-1, 1, 5)]
-    
-    for ray in rays:
-        z, y = zip(*ray)
-        ax1.plot(z, y)
+    y0 = np.linspace(-1, 1, 5)
+    z, ys = tracer.trace_rays(y0, np.zeros_like(y0))
+    ax1.plot(z, ys.T)
     ax1.set_title('Ray Tracing')
     ax1.set_xlabel('z (m)')
     ax1.set_ylabel('y (m)')
     ax1.grid(True)
     
     # Diffraction pattern
-    ax2 = fig.add_subplot(222)
     wave_calc = WaveOpticsCalculator(wave)
     r, I = wave_calc.calculate_diffraction(0.001, 1.0)  # 1mm aperture, 1m distance
     ax2.plot(r*1000, I)  # Convert to mm
@@ -123,13 +303,8 @@ def plot_system_analysis(lens_system: LensSystem, wave: WaveProperties):
     ax2.grid(True)
     
     # Temperature effects
-    ax3 = fig.add_subplot(223)
     temps = np.linspace(0, 40, 100)
-    focal_shifts = []
-    for T in temps:
-        lens_system.temperature = T
-        M = lens_system.transfer_matrix()
-        focal_shifts.append(-1/M[1,0])
+    focal_shifts = lens_system.focal_length_vs_temperature(temps)
     ax3.plot(temps, focal_shifts)
     ax3.set_title('Temperature Effects')
     ax3.set_xlabel('Temperature (°C)')
@@ -137,7 +312,6 @@ def plot_system_analysis(lens_system: LensSystem, wave: WaveProperties):
     ax3.grid(True)
     
     # Interference pattern
-    ax4 = fig.add_subplot(224)
     theta = np.linspace(-np.pi/4, np.pi/4, 1000)
     I = wave_calc.calculate_interference(0.0001, theta)  # 100µm slit separation
     ax4.plot(theta*180/np.pi, I)
@@ -146,39 +320,72 @@ def plot_system_analysis(lens_system: LensSystem, wave: WaveProperties):
     ax4.set_ylabel('Intensity')
     ax4.grid(True)
     
-    plt.tight_layout()
-    plt.savefig('optical_analysis.png')
-    plt.close()
+    fig.tight_layout()
+    save_figure(fig, 'optical_analysis.png')
 
-def main():
+def _warmup():
+    """Run each kernel once so the parallel runtime is up before first use"""
+    one = np.ones(1)
+    _transfer_matrix_core(one, one, one)
+    _airy_intensity(one, 1.0, 1.0, 1.0)
+    _interf(one, 1.0, np.empty(1))
+
+if os.environ.get("LENS_WARMUP", "1") == "1":
+    _warmup()
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Lens system analysis and optimization")
+    parser.add_argument("--config", help="CSV file with one 'focal_length,distance,n,dn_dT' row per lens "
+                                         "(m, m, -, 1e-6/°C); distance is from the previous lens and "
+                                         "ignored on the first row. Without it, piped stdin is read")
+    parser.add_argument("--target-f", type=float, help="Desired focal length (m) for optimization")
+    parser.add_argument("--interactive", action="store_true", help="Prompt for each lens")
+    args = parser.parse_args(argv)
+    interactive = args.interactive or (args.config is None and sys.stdin.isatty())
+    
     # Initialize wave properties (green light)
     wave = WaveProperties(550e-9)
     
-    # Get system parameters
-    print("Enter lens system parameters:")
-    focal_lengths = []
-    distances = []
-    materials = []
-    
-    while True:
+    if not interactive:
         try:
-            f = float(input(f"Enter focal length #{len(focal_lengths) + 1} (m, or 0 to finish): "))
-            if f == 0:
-                break
-            focal_lengths.append(f)
-            
-            if len(focal_lengths) > 1:
-                d = float(input(f"Enter distance to next lens (m): "))
-                distances.append(d)
-            
-            n = float(input(f"Enter refractive index: ") or 1.5)
-            dn_dt = float(input(f"Enter dn/dT (1e-6/°C): ") or 1.0) * 1e-6
-            materials.append(OpticalMaterial(n, dn_dt))
-            
-        except ValueError:
-            print("Please enter valid numbers.")
+            data = load_lens_table(args.config)
+        except (OSError, ValueError) as e:
+            sys.exit(f"Could not read lens data: {e}")
+        if data.size == 0:
+            print("No lenses entered. Exiting.")
+            return
+        if data.shape[1] != 4:
+            print("Expected 4 columns: focal_length,distance,n,dn_dT")
+            return
+        focal_lengths = data[:, 0]
+        distances = data[1:, 1]
+        materials = [OpticalMaterial(n, dn_dt * 1e-6) for n, dn_dt in data[:, 2:]]
+    else:
+        # Get system parameters
+        print("Enter lens system parameters:")
+        focal_lengths = []
+        distances = []
+        materials = []
+        
+        while True:
+            try:
+                f = float(input(f"Enter focal length #{len(focal_lengths) + 1} (m, or 0 to finish): "))
+                if f == 0:
+                    break
+                focal_lengths.append(f)
+                
+                if len(focal_lengths) > 1:
+                    d = float(input(f"Enter distance to next lens (m): "))
+                    distances.append(d)
+                
+                n = float(input(f"Enter refractive index: ") or 1.5)
+                dn_dt = float(input(f"Enter dn/dT (1e-6/°C): ") or 1.0) * 1e-6
+                materials.append(OpticalMaterial(n, dn_dt))
+                
+            except ValueError:
+                print("Please enter valid numbers.")
     
-    if not focal_lengths:
+    if not len(focal_lengths):
         print("No lenses entered. Exiting.")
         return
     
@@ -202,7 +409,12 @@ def main():
     print("\nAnalysis plots saved as 'optical_analysis.png'")
     
     # Optimization
-    target_f = float(input("\nEnter desired focal length for optimization (m): "))
+    target_f = args.target_f
+    if target_f is None:
+        if not interactive:
+            print("\nNo --target-f given; skipping optimization.")
+            return
+        target_f = float(input("\nEnter desired focal length for optimization (m): "))
     optimizer = OpticalSystemOptimizer(system)
     optimized_distances = optimizer.optimize_focal_length(target_f)
     